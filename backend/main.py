@@ -1,28 +1,45 @@
 import asyncio
 import base64
+import contextlib
+import contextvars
 import hashlib
 import hmac
 import json
 import os
 import re
 import secrets
+import sys
+import threading
 import time
 import traceback
+import unicodedata
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
 from typing import Optional
-from urllib.parse import quote, urlencode
+from urllib.parse import parse_qsl, quote, urlencode, urljoin, urlsplit
 
 import httpx
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Response, Request, Body
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
 from starlette.responses import StreamingResponse
 
 # 加载环境变量
 load_dotenv()
 
-app = FastAPI()
+@contextlib.asynccontextmanager
+async def _lifespan(_app):
+    # 启动工作（缓存加载、预热）都在后台进行，见下方 “启动与健康检查”
+    _startup()
+    try:
+        yield
+    finally:
+        await _shutdown()
+
+
+app = FastAPI(lifespan=_lifespan)
 
 # 允许跨域
 app.add_middleware(
@@ -50,6 +67,9 @@ COOKIE_SECURE = os.getenv("COOKIE_SECURE", "0") == "1"
 
 _AUTH_SECRET_BYTES = None
 
+# 管理接口（预热等）：未设置 ADMIN_TOKEN 时全部禁用
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # 简易防爆破（内存内）
 LOGIN_ATTEMPTS = {}
 LOGIN_WINDOW_SECONDS = 300
@@ -66,6 +86,101 @@ ENABLE_DISK_CACHE = os.getenv("ENABLE_DISK_CACHE", "1") != "0"
 TMDB_CACHE = {}
 TMDB_PREFETCH_INFLIGHT = set()
 TMDB_PREFETCH_SEMAPHORE = None
+LOADED_CACHES = set()
+
+# 图片占位图（LQIP）：由 Emby 缩成极小尺寸后内联为 data URI，随列表下发
+PLACEHOLDER_FILE = os.path.join(IMAGE_CACHE_DIR, "placeholders.json")
+PLACEHOLDER_WIDTH = int(os.getenv("PLACEHOLDER_WIDTH", "24"))
+# 占位图内联在列表 JSON 里（base64 后约 1.4 KB），超出则放弃，避免首页响应膨胀
+PLACEHOLDER_MAX_BYTES = 1024
+PLACEHOLDER_CACHE = {}
+PLACEHOLDER_INFLIGHT = set()
+PLACEHOLDER_SEMAPHORE = None
+PLACEHOLDER_TASKS = set()
+
+# 视频流调度：全局带宽预算 + 按客户端公平分配（令牌桶）+ 并发准入 + 空闲/卡顿超时
+STREAM_BANDWIDTH_BYTES = int(float(os.getenv("STREAM_BANDWIDTH_MBPS", "0")) * 1_000_000 / 8)
+STREAM_MAX_CONCURRENT = int(os.getenv("STREAM_MAX_CONCURRENT", "32"))
+STREAM_MAX_PER_CLIENT = int(os.getenv("STREAM_MAX_PER_CLIENT", "4"))
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", "60"))
+STREAM_STALL_TIMEOUT = float(os.getenv("STREAM_STALL_TIMEOUT", "30"))
+STREAM_RETRY_AFTER_SECONDS = 5
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_CLIENTS = {}
+STREAM_REAPER_TASK = None
+
+# HLS 自适应码率代理：分片落盘缓存，多个观众共享（按 LRU 淘汰）
+HLS_SEGMENT_DIR = os.path.join(CACHE_DIR, "hls")
+HLS_SEGMENT_CACHE_BYTES = int(os.getenv("HLS_SEGMENT_CACHE_MB", "512")) * 1024 * 1024
+HLS_BITRATES = sorted(
+    int(value) for value in os.getenv("HLS_BITRATES", "800000,1500000,3000000,6000000,12000000").split(",") if value.strip()
+)
+HLS_DEFAULT_BITRATE = int(os.getenv("HLS_DEFAULT_BITRATE", "3000000"))
+HLS_SEGMENT_INDEX = OrderedDict()
+HLS_SEGMENT_BYTES = 0
+HLS_SEGMENT_INFLIGHT = {}
+HLS_MEDIA_SOURCES = {}
+
+# 启动：缓存异步加载 + 可选首页预热，完成后 /readyz 才返回就绪
+STARTUP_PREWARM = os.getenv("STARTUP_PREWARM", "1") != "0"
+STARTUP_READY_TIMEOUT = float(os.getenv("STARTUP_READY_TIMEOUT", "20"))
+READY_STATE = {"ready": False, "phases": {}}
+BACKGROUND_TASKS = set()
+
+# 缓存预热：首页 + 热门剧集的图片/TMDB（WARM_INTERVAL_SECONDS=0 表示只手动触发）
+WARM_INTERVAL_SECONDS = int(os.getenv("WARM_INTERVAL_SECONDS", "0"))
+WARM_HOME_LIMIT = int(os.getenv("WARM_HOME_LIMIT", "40"))
+WARM_TOP_SERIES = int(os.getenv("WARM_TOP_SERIES", "10"))
+WARM_CONCURRENCY = int(os.getenv("WARM_CONCURRENCY", "2"))
+WARM_STATE = {"running": False}
+WARM_TASK = None
+
+# Emby 元数据请求的容错：按接口熔断 + 对冲重试 + 过期数据兜底
+EMBY_REQUEST_BUDGET_SECONDS = float(os.getenv("EMBY_REQUEST_BUDGET_SECONDS", "6"))
+EMBY_HEDGE_DELAY_MS = int(os.getenv("EMBY_HEDGE_DELAY_MS", "400"))
+EMBY_BREAKER_FAILURES = int(os.getenv("EMBY_BREAKER_FAILURES", "5"))
+EMBY_BREAKER_COOLDOWN = float(os.getenv("EMBY_BREAKER_COOLDOWN", "30"))
+EMBY_STALE_MAX_ENTRIES = int(os.getenv("EMBY_STALE_MAX_ENTRIES", "500"))
+EMBY_BREAKERS = {}
+EMBY_STALE_CACHE = OrderedDict()
+
+# 请求耗时分解（Server-Timing）与按需采样分析（默认关闭，可通过管理接口开关）
+_REQUEST_CONTEXT = contextvars.ContextVar("request_context", default=None)
+PROFILE_DIR = os.path.join(CACHE_DIR, "profiles")
+PROFILE_SETTINGS = {
+    "enabled": os.getenv("PROFILE_ENABLED", "0") == "1",
+    "threshold_ms": int(os.getenv("PROFILE_THRESHOLD_MS", "500")),
+    "sample_rate": float(os.getenv("PROFILE_SAMPLE_RATE", "0.1")),
+    "interval_ms": int(os.getenv("PROFILE_INTERVAL_MS", "5")),
+}
+PROFILE_SESSIONS = {}
+PROFILE_LOCK = threading.Lock()
+PROFILE_THREAD = None
+
+# 选集列表短期缓存：同一剧集并发/连续请求只回源一次（批量接口与 /api/videos 共用）
+EPISODE_CACHE_TTL = int(os.getenv("EPISODE_CACHE_TTL", "60"))
+EPISODE_CACHE_MAX_ENTRIES = 500
+EPISODE_CACHE = OrderedDict()
+EPISODE_INFLIGHT = {}
+BATCH_MAX_SERIES = int(os.getenv("BATCH_MAX_SERIES", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_SEMAPHORE = None
+
+# 本地搜索索引（内存内，增量更新，避免每次输入都打到 Emby）
+SEARCH_REFRESH_SECONDS = int(os.getenv("SEARCH_REFRESH_SECONDS", "600"))
+SEARCH_DOCS = {}
+SEARCH_POSTINGS = {}
+SEARCH_RETRY_SECONDS = int(os.getenv("SEARCH_RETRY_SECONDS", "60"))
+SEARCH_LAST_SYNC = 0.0
+SEARCH_LAST_ATTEMPT = 0.0
+SEARCH_SYNC_TASK = None
+
+try:
+    # 可选依赖：安装 pypinyin 后支持拼音/首字母搜索
+    from pypinyin import lazy_pinyin, Style as PinyinStyle
+except ImportError:
+    lazy_pinyin = None
+    PinyinStyle = None
 
 
 def _ensure_dir(path: str):
@@ -169,6 +284,14 @@ def _require_play_auth(request: Request):
     raise HTTPException(status_code=401, detail="Password required")
 
 
+def _require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled")
+    token = request.headers.get("x-admin-token") or ""
+    if not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Admin token required")
+
+
 def _cookie_should_be_secure(request: Request) -> bool:
     if COOKIE_SECURE:
         return True
@@ -218,22 +341,240 @@ async def auth_logout():
     return response
 
 
-def _load_tmdb_cache_from_disk():
-    if not ENABLE_DISK_CACHE:
+# --- 请求耗时与采样分析 ---
+
+def _timing_add(name: str, duration: float, count: int = 1):
+    ctx = _REQUEST_CONTEXT.get()
+    if ctx is None:
+        return
+    entry = ctx["timings"].setdefault(name, [0.0, 0])
+    entry[0] += duration
+    entry[1] += count
+
+
+@contextlib.contextmanager
+def _timed(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timing_add(name, time.perf_counter() - started)
+
+
+def _timing_count(name: str, outcome: str):
+    ctx = _REQUEST_CONTEXT.get()
+    if ctx is not None:
+        ctx["counters"].setdefault(name, Counter())[outcome] += 1
+
+
+def _format_server_timing(ctx: dict, total: float) -> str:
+    metrics = []
+    for name, (duration, count) in ctx["timings"].items():
+        desc = f';desc="{count} calls"' if count > 1 else ""
+        metrics.append(f"{name};dur={duration * 1000:.1f}{desc}")
+    for name, counter in ctx["counters"].items():
+        desc = " ".join(f"{outcome}={n}" for outcome, n in sorted(counter.items()))
+        metrics.append(f'{name};desc="{desc}"')
+    metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+def _task_frames(task, thread_frame) -> list:
+    """
+    沿 cr_await 链取出 task 当前挂起（或正在执行）的协程帧；
+    若该 task 此刻正在事件循环线程上运行，再补上最内层协程之下的同步调用
+    """
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    if frames and thread_frame is not None:
+        innermost = frames[-1]
+        below = []
+        frame = thread_frame
+        while frame is not None and frame is not innermost:
+            below.append(frame)
+            frame = frame.f_back
+        if frame is innermost:
+            frames.extend(reversed(below))
+    return frames
+
+
+def _fold_frames(frames: list) -> str:
+    return ";".join(
+        f"{f.f_code.co_name} ({os.path.basename(f.f_code.co_filename)}:{f.f_code.co_firstlineno})" for f in frames
+    )
+
+
+def _profile_sampler():
+    """
+    采样线程：定时抓取每个被采样请求自身 task 的协程栈，
+    并发请求互不干扰；未在执行的 task 采到的是它正在 await 的位置
+    """
+    global PROFILE_THREAD
+    while True:
+        with PROFILE_LOCK:
+            if not PROFILE_SESSIONS:
+                PROFILE_THREAD = None
+                return
+            thread_frames = sys._current_frames()
+            for session in PROFILE_SESSIONS.values():
+                task = session["task"]
+                if task.done():
+                    continue
+                try:
+                    frames = _task_frames(task, thread_frames.get(session["thread_id"]))
+                except Exception:
+                    # 协程栈在另一线程上随时变化，偶尔读到中间状态直接丢弃该样本
+                    continue
+                if frames:
+                    session["samples"][_fold_frames(frames)] += 1
+        time.sleep(max(1, PROFILE_SETTINGS["interval_ms"]) / 1000)
+
+
+def _is_forced_profile(request: Request) -> bool:
+    # 管理员可用 X-Profile: 1 强制采样单个请求（不受阈值限制）
+    if request.headers.get("x-profile") != "1" or not ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get("x-admin-token") or "", ADMIN_TOKEN)
+
+
+# 视频流 / HLS 分片的耗时取决于播放时长与限速，采样只会让采样线程挂满整个播放过程并写出无意义的 profile
+_PROFILE_EXCLUDED_PREFIXES = ("/api/proxy/stream/", "/api/proxy/hls/")
+
+
+def _should_sample_profile() -> bool:
+    if not PROFILE_SETTINGS["enabled"]:
+        return False
+    return secrets.randbelow(10_000) < PROFILE_SETTINGS["sample_rate"] * 10_000
+
+
+def _start_profile() -> dict:
+    global PROFILE_THREAD
+    task = asyncio.current_task()
+    session = {"task": task, "thread_id": threading.get_ident(), "samples": Counter()}
+    with PROFILE_LOCK:
+        PROFILE_SESSIONS[id(task)] = session
+        if PROFILE_THREAD is None:
+            PROFILE_THREAD = threading.Thread(target=_profile_sampler, name="profile-sampler", daemon=True)
+            PROFILE_THREAD.start()
+    return session
+
+
+def _finish_profile(session: dict, request: Request, duration: float, forced: bool):
+    with PROFILE_LOCK:
+        PROFILE_SESSIONS.pop(id(session["task"]), None)
+    if not session["samples"]:
+        return
+    if not forced and duration * 1000 < PROFILE_SETTINGS["threshold_ms"]:
         return
     try:
-        if not os.path.exists(TMDB_CACHE_FILE):
+        _ensure_dir(PROFILE_DIR)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", request.url.path).strip("_")[:60]
+        name = f"{int(time.time() * 1000)}_{request.method}_{slug}_{int(duration * 1000)}ms.folded"
+        # folded 格式：每行 “栈;栈;栈 次数”，可直接用 flamegraph.pl / speedscope 打开
+        with open(os.path.join(PROFILE_DIR, name), "w", encoding="utf-8") as f:
+            for stack, count in session["samples"].most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Profile saved: {name}")
+    except Exception as e:
+        print(f"Profile save error: {e}")
+
+
+def _request_context_middleware(app):
+    """
+    纯 ASGI 中间件（不用 BaseHTTPMiddleware，避免每个请求多一层 task 和流式响应的额外转发）：
+    设置请求上下文，并在 http.response.start 时补上 Server-Timing 与过期数据提示头
+    """
+    async def middleware(scope, receive, send):
+        if scope["type"] != "http":
+            await app(scope, receive, send)
             return
-        with open(TMDB_CACHE_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, dict):
-            TMDB_CACHE.update(data)
+
+        ctx = {"stale": set(), "timings": {}, "counters": {}}
+        token = _REQUEST_CONTEXT.set(ctx)
+        request = Request(scope)
+        started = time.perf_counter()
+        profile = None
+        forced = False
+        if not scope["path"].startswith(_PROFILE_EXCLUDED_PREFIXES):
+            forced = _is_forced_profile(request)
+            profile = _start_profile() if forced or _should_sample_profile() else None
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if scope["path"].startswith("/api/"):
+                    headers["Server-Timing"] = _format_server_timing(ctx, time.perf_counter() - started)
+                if ctx["stale"]:
+                    headers["Warning"] = '110 - "Response is Stale"'
+                    headers["X-Upstream-Stale"] = ",".join(sorted(ctx["stale"]))
+            await send(message)
+
+        try:
+            await app(scope, receive, send_with_headers)
+        finally:
+            if profile is not None:
+                _finish_profile(profile, request, time.perf_counter() - started, forced)
+            _REQUEST_CONTEXT.reset(token)
+
+    return middleware
+
+
+app.add_middleware(_request_context_middleware)
+
+
+@app.get("/api/admin/profiling")
+async def profiling_status(request: Request):
+    _require_admin(request)
+    try:
+        files = sorted(os.listdir(PROFILE_DIR), reverse=True)[:50]
+    except FileNotFoundError:
+        files = []
+    return {**PROFILE_SETTINGS, "active_sessions": len(PROFILE_SESSIONS), "recent_profiles": files}
+
+
+@app.post("/api/admin/profiling")
+async def profiling_update(request: Request, payload: dict = Body(...)):
+    _require_admin(request)
+    if "enabled" in payload:
+        PROFILE_SETTINGS["enabled"] = bool(payload["enabled"])
+    for key, cast in (("threshold_ms", int), ("sample_rate", float), ("interval_ms", int)):
+        if key in payload:
+            try:
+                PROFILE_SETTINGS[key] = cast(payload[key])
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"Invalid {key}")
+    return PROFILE_SETTINGS
+
+
+def _read_json_cache(path: str) -> dict:
+    if not ENABLE_DISK_CACHE or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data if isinstance(data, dict) else {}
+
+
+async def _load_tmdb_cache_from_disk():
+    try:
+        data = await asyncio.to_thread(_read_json_cache, TMDB_CACHE_FILE)
+        # 加载期间已写入内存的新结果优先
+        for key, value in data.items():
+            TMDB_CACHE.setdefault(key, value)
     except Exception as e:
         print(f"TMDB cache load error: {e}")
+    finally:
+        LOADED_CACHES.add("tmdb")
 
 
 def _save_tmdb_cache_to_disk():
-    if not ENABLE_DISK_CACHE:
+    # 磁盘缓存加载完成前不落盘，避免用不完整的内存缓存覆盖
+    if not ENABLE_DISK_CACHE or "tmdb" not in LOADED_CACHES:
         return
     try:
         _ensure_dir(CACHE_DIR)
@@ -249,7 +590,9 @@ def _get_tmdb_cached(name: str, emby_type: str):
     cache_key = f"{name}_{emby_type}"
     cached = TMDB_CACHE.get(cache_key)
     if not isinstance(cached, dict):
+        _timing_count("cache-tmdb", "miss")
         return None, None
+    _timing_count("cache-tmdb", "hit")
     return cached.get("backdrop"), cached.get("logo")
 
 
@@ -279,7 +622,117 @@ async def _prefetch_tmdb_images(name: str, emby_type: str):
     asyncio.create_task(runner())
 
 
-_load_tmdb_cache_from_disk()
+async def _load_placeholders_from_disk():
+    try:
+        data = await asyncio.to_thread(_read_json_cache, PLACEHOLDER_FILE)
+        for key, value in data.items():
+            PLACEHOLDER_CACHE.setdefault(key, value)
+    except Exception as e:
+        print(f"Placeholder cache load error: {e}")
+    finally:
+        LOADED_CACHES.add("placeholders")
+
+
+def _save_placeholders_to_disk():
+    if not ENABLE_DISK_CACHE or "placeholders" not in LOADED_CACHES:
+        return
+    try:
+        _ensure_dir(IMAGE_CACHE_DIR)
+        tmp_path = PLACEHOLDER_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(PLACEHOLDER_CACHE, f, ensure_ascii=False)
+        os.replace(tmp_path, PLACEHOLDER_FILE)
+    except Exception as e:
+        print(f"Placeholder cache save error: {e}")
+
+
+def _image_placeholder_jobs(item: dict):
+    """
+    按 ImageTags 生成占位图缓存键（图片更新后 tag 变化，自动失效）
+    """
+    item_id = item.get("Id")
+    if not item_id:
+        return {}
+    jobs = {}
+    primary_tag = (item.get("ImageTags") or {}).get("Primary")
+    if primary_tag:
+        jobs["poster"] = (f"{item_id}/Primary/{primary_tag}", "Primary")
+    backdrop_tags = item.get("BackdropImageTags") or []
+    if backdrop_tags:
+        jobs["backdrop"] = (f"{item_id}/Backdrop/0/{backdrop_tags[0]}", "Backdrop/0")
+    return jobs
+
+
+def _get_image_placeholders(item: dict, missing: dict):
+    """
+    只读缓存；未命中的放入 missing，由后台 worker 计算（不阻塞列表接口）
+    """
+    result = {"poster": None, "backdrop": None}
+    for kind, (cache_key, image_path) in _image_placeholder_jobs(item).items():
+        if cache_key in PLACEHOLDER_CACHE:
+            result[kind] = PLACEHOLDER_CACHE[cache_key] or None
+            _timing_count("cache-placeholder", "hit")
+            continue
+        _timing_count("cache-placeholder", "miss")
+        if cache_key not in PLACEHOLDER_INFLIGHT:
+            missing[cache_key] = (item["Id"], image_path)
+    return result
+
+
+async def _fetch_image_placeholder(client: httpx.AsyncClient, item_id: str, image_path: str):
+    """
+    返回 data URI；没有该图片时返回 ""（可缓存）；体积超限返回 None（不缓存，下次再试）
+    """
+    # 统一转成 webp，避免 PNG 原图缩小后仍超过 PLACEHOLDER_MAX_BYTES
+    params = {"api_key": API_KEY, "maxWidth": PLACEHOLDER_WIDTH, "quality": 30, "format": "webp"}
+    resp = await client.get(f"{EMBY_HOST}/emby/Items/{item_id}/Images/{image_path}", params=params, timeout=10.0)
+    content_type = (resp.headers.get("content-type") or "").split(";")[0].strip()
+    if resp.status_code != 200 or not content_type.startswith("image/"):
+        return ""
+    if len(resp.content) > PLACEHOLDER_MAX_BYTES:
+        return None
+    return f"data:{content_type};base64," + base64.b64encode(resp.content).decode("ascii")
+
+
+def _schedule_image_placeholders(missing: dict):
+    if not API_KEY or not missing:
+        return
+
+    jobs = {key: job for key, job in missing.items() if key not in PLACEHOLDER_INFLIGHT}
+    if not jobs:
+        return
+    PLACEHOLDER_INFLIGHT.update(jobs)
+
+    async def runner():
+        global PLACEHOLDER_SEMAPHORE
+        if PLACEHOLDER_SEMAPHORE is None:
+            PLACEHOLDER_SEMAPHORE = asyncio.Semaphore(4)
+
+        async def worker(client, cache_key, item_id, image_path):
+            async with PLACEHOLDER_SEMAPHORE:
+                try:
+                    placeholder = await _fetch_image_placeholder(client, item_id, image_path)
+                    if placeholder is not None:
+                        PLACEHOLDER_CACHE[cache_key] = placeholder
+                except Exception:
+                    # 网络失败不写入，下次列表请求时重试
+                    pass
+
+        try:
+            async with httpx.AsyncClient() as client:
+                await asyncio.gather(
+                    *(worker(client, key, item_id, path) for key, (item_id, path) in jobs.items())
+                )
+            _save_placeholders_to_disk()
+        except Exception as e:
+            print(f"Placeholder worker error: {e}")
+        finally:
+            PLACEHOLDER_INFLIGHT.difference_update(jobs)
+
+    task = asyncio.create_task(runner())
+    PLACEHOLDER_TASKS.add(task)
+    task.add_done_callback(PLACEHOLDER_TASKS.discard)
+
 
 # --- 核心代理逻辑 (保护 API Key) ---
 
@@ -299,6 +752,33 @@ def _is_allowed_emby_image_path(clean_path: str) -> bool:
     return index is None
 
 
+def _image_cache_paths(clean_path: str, forward_params: dict):
+    cache_params = dict(forward_params)
+    cache_params.pop("api_key", None)
+    key = clean_path + "?" + urlencode(sorted(cache_params.items()))
+    cache_key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    cache_meta_path = os.path.join(IMAGE_CACHE_DIR, f"{cache_key}.json")
+    cache_bytes_path = os.path.join(IMAGE_CACHE_DIR, f"{cache_key}.bin")
+    return cache_key, cache_meta_path, cache_bytes_path
+
+
+def _write_image_cache(cache_meta_path: str, cache_bytes_path: str, resp: httpx.Response):
+    _ensure_dir(IMAGE_CACHE_DIR)
+    meta = {
+        "content_type": resp.headers.get("content-type"),
+        "etag": resp.headers.get("etag"),
+        "last_modified": resp.headers.get("last-modified"),
+    }
+    tmp_meta = cache_meta_path + ".tmp"
+    tmp_bytes = cache_bytes_path + ".tmp"
+    with open(tmp_bytes, "wb") as f:
+        f.write(resp.content)
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_bytes, cache_bytes_path)
+    os.replace(tmp_meta, cache_meta_path)
+
+
 @app.get("/api/proxy/image")
 async def proxy_emby_image(path: str, request: Request):
     """
@@ -329,14 +809,10 @@ async def proxy_emby_image(path: str, request: Request):
     cache_bytes_path = None
     if ENABLE_DISK_CACHE:
         try:
-            cache_params = dict(forward_params)
-            cache_params.pop("api_key", None)
-            key = clean_path + "?" + urlencode(sorted(cache_params.items()))
-            cache_key = hashlib.sha256(key.encode("utf-8")).hexdigest()
-            cache_meta_path = os.path.join(IMAGE_CACHE_DIR, f"{cache_key}.json")
-            cache_bytes_path = os.path.join(IMAGE_CACHE_DIR, f"{cache_key}.bin")
+            cache_key, cache_meta_path, cache_bytes_path = _image_cache_paths(clean_path, forward_params)
 
             if os.path.exists(cache_meta_path) and os.path.exists(cache_bytes_path):
+                _timing_count("cache-image", "hit")
                 with open(cache_meta_path, "r", encoding="utf-8") as f:
                     meta = json.load(f) or {}
 
@@ -361,9 +837,11 @@ async def proxy_emby_image(path: str, request: Request):
             cache_meta_path = None
             cache_bytes_path = None
 
+    _timing_count("cache-image", "miss")
     async with httpx.AsyncClient() as client:
         try:
-            resp = await client.get(emby_url, params=forward_params, headers=upstream_headers, timeout=10.0)
+            with _timed("emby-image"):
+                resp = await client.get(emby_url, params=forward_params, headers=upstream_headers, timeout=10.0)
             if resp.status_code not in (200, 304):
                 return Response(status_code=resp.status_code)
 
@@ -377,20 +855,7 @@ async def proxy_emby_image(path: str, request: Request):
 
             if ENABLE_DISK_CACHE and cache_key and cache_meta_path and cache_bytes_path:
                 try:
-                    _ensure_dir(IMAGE_CACHE_DIR)
-                    meta = {
-                        "content_type": resp.headers.get("content-type"),
-                        "etag": resp.headers.get("etag"),
-                        "last_modified": resp.headers.get("last-modified"),
-                    }
-                    tmp_meta = cache_meta_path + ".tmp"
-                    tmp_bytes = cache_bytes_path + ".tmp"
-                    with open(tmp_bytes, "wb") as f:
-                        f.write(resp.content)
-                    with open(tmp_meta, "w", encoding="utf-8") as f:
-                        json.dump(meta, f, ensure_ascii=False)
-                    os.replace(tmp_bytes, cache_bytes_path)
-                    os.replace(tmp_meta, cache_meta_path)
+                    _write_image_cache(cache_meta_path, cache_bytes_path, resp)
                 except Exception:
                     pass
 
@@ -399,6 +864,163 @@ async def proxy_emby_image(path: str, request: Request):
             print(f"Proxy Image Error: {e}")
             raise HTTPException(status_code=502)
 
+# --- 视频流调度 ---
+
+def _stream_client_key(request: Request) -> str:
+    # 优先按登录 Cookie 区分客户端（同一 NAT 后的多个用户互不影响），否则按 IP
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    if token:
+        return "c:" + hashlib.sha256(token.encode("utf-8")).hexdigest()[:12]
+    return "ip:" + _get_client_ip(request)
+
+
+def _stream_active_count() -> int:
+    return sum(len(client["streams"]) for client in STREAM_CLIENTS.values())
+
+
+def _admit_stream(request: Request, item_id: str) -> dict:
+    """
+    准入控制：超过全局/单客户端并发上限时立即返回 503 + Retry-After
+    """
+    client_key = _stream_client_key(request)
+    client = STREAM_CLIENTS.get(client_key)
+    retry_headers = {"Retry-After": str(STREAM_RETRY_AFTER_SECONDS)}
+
+    if STREAM_MAX_CONCURRENT > 0 and _stream_active_count() >= STREAM_MAX_CONCURRENT:
+        raise HTTPException(status_code=503, detail="Too many active streams", headers=retry_headers)
+    if client and STREAM_MAX_PER_CLIENT > 0 and len(client["streams"]) >= STREAM_MAX_PER_CLIENT:
+        raise HTTPException(status_code=503, detail="Too many streams for this client", headers=retry_headers)
+
+    now = time.monotonic()
+    if client is None:
+        client = {"tokens": float(STREAM_CHUNK_SIZE), "refilled_at": now, "last_activity": now, "streams": {}}
+        STREAM_CLIENTS[client_key] = client
+
+    stream = {
+        "id": secrets.token_hex(6),
+        "client_key": client_key,
+        "item_id": item_id,
+        "range": request.headers.get("range"),
+        "started_at": time.time(),
+        "last_activity": now,
+        "bytes": 0,
+        "closers": [],
+        "released": False,
+    }
+    client["streams"][stream["id"]] = stream
+    _ensure_stream_reaper()
+    return stream
+
+
+def _release_stream(stream: dict):
+    if stream["released"]:
+        return
+    stream["released"] = True
+    client = STREAM_CLIENTS.get(stream["client_key"])
+    if not client:
+        return
+    client["streams"].pop(stream["id"], None)
+    if not client["streams"]:
+        STREAM_CLIENTS.pop(stream["client_key"], None)
+
+
+def _stream_fair_share() -> float:
+    """
+    只在近期有数据流动的客户端之间平分预算，卡住的客户端不占份额
+    """
+    now = time.monotonic()
+    active = sum(1 for client in STREAM_CLIENTS.values() if now - client["last_activity"] < 2.0)
+    return STREAM_BANDWIDTH_BYTES / max(1, active)
+
+
+async def _throttle_stream(stream: dict, nbytes: int):
+    now = time.monotonic()
+    stream["last_activity"] = now
+    stream["bytes"] += nbytes
+    client = STREAM_CLIENTS.get(stream["client_key"])
+    if client is None:
+        return
+    client["last_activity"] = now
+    if STREAM_BANDWIDTH_BYTES <= 0:
+        return
+
+    # 同一客户端的所有并发 Range 共用一个令牌桶
+    while True:
+        rate = _stream_fair_share()
+        now = time.monotonic()
+        burst = max(rate, float(STREAM_CHUNK_SIZE))
+        client["tokens"] = min(burst, client["tokens"] + (now - client["refilled_at"]) * rate)
+        client["refilled_at"] = now
+        if client["tokens"] >= nbytes:
+            client["tokens"] -= nbytes
+            return
+        await asyncio.sleep(min(1.0, (nbytes - client["tokens"]) / rate))
+        client["last_activity"] = time.monotonic()
+
+
+async def _close_stream_upstream(stream: dict):
+    for closer in stream["closers"]:
+        try:
+            await closer()
+        except Exception:
+            pass
+
+
+async def _stream_reaper():
+    """
+    定期回收长时间没有推进的流（客户端暂停/卡死），释放上游连接与并发名额
+    """
+    while STREAM_CLIENTS:
+        await asyncio.sleep(5)
+        now = time.monotonic()
+        for client in list(STREAM_CLIENTS.values()):
+            for stream in list(client["streams"].values()):
+                if now - stream["last_activity"] > STREAM_IDLE_TIMEOUT:
+                    print(f"Stream idle timeout: {stream['item_id']} ({stream['client_key']})")
+                    _release_stream(stream)
+                    await _close_stream_upstream(stream)
+
+
+def _ensure_stream_reaper():
+    global STREAM_REAPER_TASK
+    if STREAM_IDLE_TIMEOUT <= 0:
+        return
+    if STREAM_REAPER_TASK is None or STREAM_REAPER_TASK.done():
+        STREAM_REAPER_TASK = asyncio.create_task(_stream_reaper())
+
+
+@app.get("/api/admin/streams")
+async def stream_allocation(request: Request):
+    _require_admin(request)
+    now = time.monotonic()
+    fair_share = _stream_fair_share() if STREAM_BANDWIDTH_BYTES > 0 else None
+    clients = []
+    for client_key, client in STREAM_CLIENTS.items():
+        active = now - client["last_activity"] < 2.0
+        clients.append({
+            "client": client_key,
+            "active": active,
+            "allocated_bps": int(fair_share * 8) if fair_share and active else None,
+            "streams": [
+                {
+                    "item_id": stream["item_id"],
+                    "range": stream["range"],
+                    "bytes": stream["bytes"],
+                    "age_s": round(time.time() - stream["started_at"], 1),
+                    "idle_s": round(now - stream["last_activity"], 1),
+                }
+                for stream in client["streams"].values()
+            ],
+        })
+    return {
+        "budget_bps": STREAM_BANDWIDTH_BYTES * 8 or None,
+        "max_concurrent": STREAM_MAX_CONCURRENT,
+        "max_per_client": STREAM_MAX_PER_CLIENT,
+        "active_streams": _stream_active_count(),
+        "clients": clients,
+    }
+
+
 @app.get("/api/proxy/stream/{item_id}")
 async def proxy_emby_stream(item_id: str, request: Request):
     """
@@ -414,17 +1036,21 @@ async def proxy_emby_stream(item_id: str, request: Request):
     if range_header:
         headers["Range"] = range_header
     
-    # 使用独立的 Client 实例以控制生命周期，并禁用超时（防止播放中断）
-    client = httpx.AsyncClient(timeout=None)
+    stream = _admit_stream(request, item_id)
+
+    # 使用独立的 Client 实例以控制生命周期；读超时只用于识别上游卡死，正常播放不受影响
+    client = httpx.AsyncClient(timeout=httpx.Timeout(STREAM_STALL_TIMEOUT or None, connect=10.0))
     req = client.build_request("GET", stream_url, headers=headers)
     
     try:
         # 发送请求但不立即下载 Body
         upstream_resp = await client.send(req, stream=True)
     except Exception as e:
+        _release_stream(stream)
         await client.aclose()
         print(f"Stream Connect Error: {e}")
         raise HTTPException(status_code=502, detail="Upstream Connect Error")
+    stream["closers"] = [upstream_resp.aclose, client.aclose]
 
     # 2. 筛选需要转发给浏览器的响应头
     forward_headers = {}
@@ -439,12 +1065,17 @@ async def proxy_emby_stream(item_id: str, request: Request):
     # 3. 定义流生成器 (一边收一边发)
     async def stream_generator():
         try:
-            async for chunk in upstream_resp.aiter_bytes(chunk_size=64 * 1024): # 64KB chunks
+            async for chunk in upstream_resp.aiter_bytes(chunk_size=STREAM_CHUNK_SIZE): # 64KB chunks
+                if stream["released"]:
+                    break
+                await _throttle_stream(stream, len(chunk))
                 yield chunk
         except Exception as e:
-            print(f"Stream Transfer Error: {e}")
+            if not stream["released"]:
+                print(f"Stream Transfer Error: {e}")
         finally:
             # 必须手动关闭上游连接
+            _release_stream(stream)
             await upstream_resp.aclose()
             await client.aclose()
 
@@ -456,6 +1087,332 @@ async def proxy_emby_stream(item_id: str, request: Request):
         media_type=upstream_resp.headers.get("content-type")
     )
 
+# --- HLS 代理 ---
+
+_HLS_URI_ATTR_RE = re.compile(r'URI="(?P<uri>[^"]+)"')
+_MEDIA_SOURCE_ID_RE = re.compile(r"[A-Za-z0-9_-]{1,64}")
+_HLS_SEGMENT_TYPES = {
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".aac": "audio/aac",
+    ".vtt": "text/vtt",
+}
+
+
+def _pick_hls_bitrate(request: Request, requested: Optional[int] = None) -> int:
+    """
+    选择码率档位：显式 bitrate 参数 > Save-Data/ECT/Downlink 客户端提示 > 默认档位
+    """
+    ladder = HLS_BITRATES or [HLS_DEFAULT_BITRATE]
+
+    def fit(cap):
+        candidates = [b for b in ladder if b <= cap]
+        return candidates[-1] if candidates else ladder[0]
+
+    if requested:
+        return fit(requested)
+    if (request.headers.get("save-data") or "").lower() == "on":
+        return ladder[0]
+
+    ect = (request.headers.get("ect") or "").lower()
+    if ect in ("slow-2g", "2g"):
+        return ladder[0]
+    if ect == "3g":
+        return fit(1_500_000)
+
+    try:
+        # Downlink 单位为 Mbps，只用七成带宽留出余量
+        downlink = float(request.headers.get("downlink") or 0)
+    except ValueError:
+        downlink = 0
+    if downlink > 0:
+        return fit(int(downlink * 1_000_000 * 0.7))
+    return fit(HLS_DEFAULT_BITRATE)
+
+
+def _hls_proxy_uri(item_id: str, media_source_id: str, upstream_url: str, bitrate: int) -> str:
+    """
+    把上游 URI 改写为签名后的后端地址（不含 api_key，客户端无法篡改路径）
+    """
+    parts = urlsplit(upstream_url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() != "api_key"]
+    ref = parts.path + ("?" + urlencode(query) if query else "")
+    payload = {"u": ref, "b": bitrate, "m": media_source_id}
+    token = _b64url_encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    sig = _sign_auth_payload(f"{item_id}.{token}")
+    name = parts.path.rsplit("/", 1)[-1] or "index"
+    return f"/api/proxy/hls/{item_id}/{quote(name)}?t={token}&s={sig}"
+
+
+def _decode_hls_token(item_id: str, token: str, sig: str):
+    if not token or not sig:
+        return None
+    if not hmac.compare_digest(_sign_auth_payload(f"{item_id}.{token}"), sig):
+        return None
+    try:
+        payload = json.loads(_b64url_decode(token).decode("utf-8"))
+        ref = payload["u"]
+        bitrate = int(payload["b"])
+        media_source_id = str(payload["m"])
+    except Exception:
+        return None
+    if not isinstance(ref, str) or not ref.lower().startswith(f"/emby/videos/{item_id.lower()}/"):
+        return None
+    return ref, bitrate, media_source_id
+
+
+def _rewrite_hls_playlist(text: str, base_url: str, item_id: str, media_source_id: str, bitrate: int) -> str:
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            lines.append(line)
+        elif stripped.startswith("#"):
+            # #EXT-X-MEDIA / #EXT-X-MAP / #EXT-X-KEY 等标签里的 URI 也要改写
+            lines.append(_HLS_URI_ATTR_RE.sub(
+                lambda m: f'URI="{_hls_proxy_uri(item_id, media_source_id, urljoin(base_url, m.group("uri")), bitrate)}"',
+                line,
+            ))
+        else:
+            lines.append(_hls_proxy_uri(item_id, media_source_id, urljoin(base_url, stripped), bitrate))
+    return "\n".join(lines) + "\n"
+
+
+def _hls_playlist_response(text: str) -> Response:
+    return Response(content=text, headers={"Cache-Control": "no-store"}, media_type="application/vnd.apple.mpegurl")
+
+
+def _scan_hls_segments() -> list:
+    entries = []
+    try:
+        for name in os.listdir(HLS_SEGMENT_DIR):
+            if name.endswith(".tmp"):
+                continue
+            stat = os.stat(os.path.join(HLS_SEGMENT_DIR, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+    except FileNotFoundError:
+        pass
+    return [(name, size) for _, name, size in sorted(entries)]
+
+
+async def _load_hls_segment_index():
+    global HLS_SEGMENT_BYTES
+    if not ENABLE_DISK_CACHE:
+        return
+    try:
+        entries = await asyncio.to_thread(_scan_hls_segments)
+        # 磁盘上的旧分片排在 LRU 最前面；加载期间新写入的分片已计入，跳过
+        for name, size in reversed(entries):
+            if name in HLS_SEGMENT_INDEX:
+                continue
+            HLS_SEGMENT_INDEX[name] = size
+            HLS_SEGMENT_INDEX.move_to_end(name, last=False)
+            HLS_SEGMENT_BYTES += size
+    except Exception as e:
+        print(f"HLS segment index load error: {e}")
+    finally:
+        LOADED_CACHES.add("hls")
+    _evict_hls_segments()
+
+
+def _evict_hls_segments():
+    global HLS_SEGMENT_BYTES
+    while HLS_SEGMENT_INDEX and HLS_SEGMENT_BYTES > HLS_SEGMENT_CACHE_BYTES:
+        name, size = HLS_SEGMENT_INDEX.popitem(last=False)
+        HLS_SEGMENT_BYTES -= size
+        try:
+            os.remove(os.path.join(HLS_SEGMENT_DIR, name))
+        except OSError:
+            pass
+
+
+def _hls_upstream_params(ref: str) -> dict:
+    params = dict(parse_qsl(ref.split("?", 1)[1], keep_blank_values=True)) if "?" in ref else {}
+    params["api_key"] = API_KEY
+    return params
+
+
+async def _fetch_hls_segment(upstream_url: str, params: dict, cache_name: Optional[str]) -> bytes:
+    global HLS_SEGMENT_BYTES
+    async with httpx.AsyncClient() as client:
+        resp = await client.get(upstream_url, params=params, timeout=30.0)
+    if resp.status_code != 200:
+        raise HTTPException(status_code=resp.status_code if resp.status_code >= 400 else 502)
+    content = resp.content
+
+    if cache_name:
+        try:
+            _ensure_dir(HLS_SEGMENT_DIR)
+            path = os.path.join(HLS_SEGMENT_DIR, cache_name)
+            with open(path + ".tmp", "wb") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+            HLS_SEGMENT_BYTES += len(content) - HLS_SEGMENT_INDEX.pop(cache_name, 0)
+            HLS_SEGMENT_INDEX[cache_name] = len(content)
+            _evict_hls_segments()
+        except Exception as e:
+            print(f"HLS segment cache write error: {e}")
+    return content
+
+
+async def _get_hls_segment(item_id: str, media_source_id: str, ref: str, bitrate: int) -> bytes:
+    """
+    分片按 (item, 媒体源, 码率档位, 路径) 共享缓存，与观众的 PlaySessionId 无关；同一分片并发请求只回源一次
+    """
+    global HLS_SEGMENT_BYTES
+    path = ref.split("?", 1)[0]
+    cache_name = None
+    if ENABLE_DISK_CACHE:
+        cache_name = hashlib.sha256(f"{item_id}|{media_source_id}|{bitrate}|{path}".encode("utf-8")).hexdigest()
+        if cache_name in HLS_SEGMENT_INDEX:
+            try:
+                with open(os.path.join(HLS_SEGMENT_DIR, cache_name), "rb") as f:
+                    content = f.read()
+                HLS_SEGMENT_INDEX.move_to_end(cache_name)
+                return content
+            except OSError:
+                HLS_SEGMENT_BYTES -= HLS_SEGMENT_INDEX.pop(cache_name, 0)
+
+    inflight_key = cache_name or ref
+    task = HLS_SEGMENT_INFLIGHT.get(inflight_key)
+    if task is None:
+        task = asyncio.create_task(_fetch_hls_segment(f"{EMBY_HOST}{path}", _hls_upstream_params(ref), cache_name))
+        HLS_SEGMENT_INFLIGHT[inflight_key] = task
+        task.add_done_callback(lambda _: HLS_SEGMENT_INFLIGHT.pop(inflight_key, None))
+    return await asyncio.shield(task)
+
+
+async def _get_media_source_id(item_id: str) -> str:
+    """
+    未指定 mediaSourceId 时从 PlaybackInfo 取第一个媒体源（多版本条目的媒体源 ID 不等于 item ID）
+    """
+    cached = HLS_MEDIA_SOURCES.get(item_id)
+    if cached:
+        return cached
+    params = {"api_key": API_KEY}
+    if USER_ID:
+        params["UserId"] = USER_ID
+    try:
+        async with httpx.AsyncClient() as client:
+            data = await _emby_get_json(client, f"/Items/{item_id}/PlaybackInfo", params)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            raise HTTPException(status_code=404, detail="Item not found")
+        print(f"HLS PlaybackInfo Error: {e}")
+        raise HTTPException(status_code=502, detail="Upstream Connect Error")
+    except Exception as e:
+        # 超时 / 5xx / 熔断均视为上游不可用
+        print(f"HLS PlaybackInfo Error: {e}")
+        raise HTTPException(status_code=502, detail="Upstream Connect Error")
+    sources = data.get("MediaSources") or []
+    if not sources or not sources[0].get("Id"):
+        raise HTTPException(status_code=404, detail="No media source")
+    HLS_MEDIA_SOURCES[item_id] = str(sources[0]["Id"])
+    return HLS_MEDIA_SOURCES[item_id]
+
+
+def _hls_viewer_session(request: Request, item_id: str, media_source_id: str, tier: int) -> tuple:
+    """
+    每个观众独立的 PlaySessionId / DeviceId（由登录 Cookie 派生），
+    避免多个观众共用一个 Emby 转码会话而互相 seek/停止
+    """
+    viewer = _stream_client_key(request)
+    session_id = hashlib.sha256(f"{viewer}|{item_id}|{media_source_id}|{tier}".encode("utf-8")).hexdigest()[:32]
+    device_id = "ydyd-" + hashlib.sha256(viewer.encode("utf-8")).hexdigest()[:16]
+    return session_id, device_id
+
+
+@app.get("/api/proxy/hls/{item_id}/{name}")
+async def proxy_emby_hls(
+    item_id: str,
+    name: str,
+    request: Request,
+    t: Optional[str] = None,
+    s: Optional[str] = None,
+    bitrate: Optional[int] = None,
+    mediaSourceId: Optional[str] = None,
+):
+    """
+    HLS 代理：master.m3u8 按客户端提示选码率，子播放列表/分片地址改写为签名后的后端地址
+    """
+    _require_play_auth(request)
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API Key not configured")
+
+    if t is None:
+        if name != "master.m3u8":
+            raise HTTPException(status_code=404)
+        if mediaSourceId is not None and not _MEDIA_SOURCE_ID_RE.fullmatch(mediaSourceId):
+            raise HTTPException(status_code=400, detail="Invalid mediaSourceId")
+        media_source_id = mediaSourceId or await _get_media_source_id(item_id)
+        tier = _pick_hls_bitrate(request, bitrate)
+        session_id, device_id = _hls_viewer_session(request, item_id, media_source_id, tier)
+        params = {
+            "api_key": API_KEY,
+            "MediaSourceId": media_source_id,
+            "MaxStreamingBitrate": tier,
+            "VideoCodec": "h264",
+            "AudioCodec": "aac",
+            "PlaySessionId": session_id,
+            "DeviceId": device_id,
+        }
+        upstream_url = f"{EMBY_HOST}/emby/Videos/{item_id}/master.m3u8"
+        try:
+            async with httpx.AsyncClient() as client:
+                resp = await client.get(upstream_url, params=params, timeout=15.0)
+        except Exception as e:
+            print(f"HLS Master Error: {e}")
+            raise HTTPException(status_code=502, detail="Upstream Connect Error")
+        if resp.status_code != 200:
+            raise HTTPException(status_code=502, detail="Failed to fetch HLS playlist")
+        return _hls_playlist_response(_rewrite_hls_playlist(resp.text, str(resp.url), item_id, media_source_id, tier))
+
+    decoded = _decode_hls_token(item_id, t, s)
+    if not decoded:
+        raise HTTPException(status_code=403, detail="Invalid HLS token")
+    ref, tier, media_source_id = decoded
+    upstream_url = f"{EMBY_HOST}{ref.split('?', 1)[0]}"
+
+    if ref.split("?", 1)[0].lower().endswith(".m3u8"):
+        try:
+            async with httpx.AsyncClient() as client:
+                resp = await client.get(upstream_url, params=_hls_upstream_params(ref), timeout=15.0)
+        except Exception as e:
+            print(f"HLS Playlist Error: {e}")
+            raise HTTPException(status_code=502, detail="Upstream Connect Error")
+        if resp.status_code != 200:
+            raise HTTPException(status_code=502, detail="Failed to fetch HLS playlist")
+        return _hls_playlist_response(_rewrite_hls_playlist(resp.text, str(resp.url), item_id, media_source_id, tier))
+
+    # 分片与原画流共用准入控制和客户端令牌桶，HLS 观众不能绕过带宽调度
+    stream = _admit_stream(request, item_id)
+    try:
+        content = await _get_hls_segment(item_id, media_source_id, ref, tier)
+    except HTTPException:
+        _release_stream(stream)
+        raise
+    except Exception as e:
+        _release_stream(stream)
+        print(f"HLS Segment Error: {e}")
+        raise HTTPException(status_code=502, detail="Upstream Connect Error")
+
+    async def segment_generator():
+        try:
+            for offset in range(0, len(content), STREAM_CHUNK_SIZE):
+                chunk = content[offset:offset + STREAM_CHUNK_SIZE]
+                await _throttle_stream(stream, len(chunk))
+                yield chunk
+        finally:
+            _release_stream(stream)
+
+    ext = os.path.splitext(ref.split("?", 1)[0])[1].lower()
+    return StreamingResponse(
+        segment_generator(),
+        headers={"Cache-Control": "private, max-age=3600", "Content-Length": str(len(content))},
+        media_type=_HLS_SEGMENT_TYPES.get(ext, "application/octet-stream"),
+    )
+
 # --- 辅助函数 ---
 
 _SORT_SEASON_EP_RE = re.compile(r"S(?P<season>\d+)\s*E(?P<ep>\d+)", re.IGNORECASE)
@@ -589,209 +1546,664 @@ async def fetch_tmdb_images(client: httpx.AsyncClient, name: str, emby_type: str
         print(f"TMDB Error: {e}")
         return None, None
 
+# --- Emby 元数据请求（熔断/对冲/过期兜底）---
+
+_EMBY_ID_SEGMENT_RE = re.compile(r"/(?:[0-9a-fA-F]{32}|\d+)(?=/|$)")
+
+
+def _emby_endpoint_label(path: str) -> str:
+    return _EMBY_ID_SEGMENT_RE.sub("/{id}", path)
+
+
+def _get_breaker(endpoint: str) -> dict:
+    breaker = EMBY_BREAKERS.get(endpoint)
+    if breaker is None:
+        breaker = {
+            "endpoint": endpoint,
+            "state": "closed",
+            "failures": 0,
+            "opened_at": 0.0,
+            "probe": False,
+            "latencies": deque(maxlen=50),
+        }
+        EMBY_BREAKERS[endpoint] = breaker
+    return breaker
+
+
+def _breaker_allows(breaker: dict) -> bool:
+    if breaker["state"] == "open":
+        if time.monotonic() - breaker["opened_at"] < EMBY_BREAKER_COOLDOWN:
+            return False
+        breaker["state"] = "half_open"
+        breaker["probe"] = False
+    if breaker["state"] == "half_open":
+        # 半开状态只放行一个探测请求
+        if breaker["probe"]:
+            return False
+        breaker["probe"] = True
+    return True
+
+
+def _breaker_record(breaker: dict, ok: bool):
+    breaker["probe"] = False
+    if ok:
+        breaker["state"] = "closed"
+        breaker["failures"] = 0
+        return
+    breaker["failures"] += 1
+    if breaker["state"] == "half_open" or breaker["failures"] >= EMBY_BREAKER_FAILURES:
+        if breaker["state"] != "open":
+            print(f"⚠️ Emby 熔断打开: {breaker['endpoint']}")
+        breaker["state"] = "open"
+        breaker["opened_at"] = time.monotonic()
+
+
+def _hedge_delay(breaker: dict) -> float:
+    # 有足够样本时按该接口近期 P90 延迟对冲，否则用固定值
+    samples = sorted(breaker["latencies"])
+    if len(samples) >= 10:
+        return max(0.05, samples[int(len(samples) * 0.9) - 1])
+    return EMBY_HEDGE_DELAY_MS / 1000
+
+
+def _is_client_error(exc: Exception) -> bool:
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code < 500
+
+
+async def _hedged_get_json(client: httpx.AsyncClient, url: str, params: dict, breaker: dict, hedge: bool):
+    """
+    幂等 GET：超过对冲延迟仍未返回时再发一个相同请求，取先成功的结果，总耗时不超过预算
+    """
+    started = time.perf_counter()
+    deadline = started + EMBY_REQUEST_BUDGET_SECONDS
+
+    async def attempt():
+        resp = await client.get(url, params=params, timeout=EMBY_REQUEST_BUDGET_SECONDS)
+        resp.raise_for_status()
+        return resp.json()
+
+    tasks = [asyncio.create_task(attempt())]
+    pending = set(tasks)
+    last_error = None
+    try:
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            wait_for = remaining
+            if hedge and len(tasks) == 1:
+                wait_for = min(remaining, max(0.0, started + _hedge_delay(breaker) - time.perf_counter()))
+            done, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    breaker["latencies"].append(time.perf_counter() - started)
+                    return task.result()
+                last_error = task.exception()
+                if _is_client_error(last_error):
+                    raise last_error
+            if hedge and len(tasks) == 1 and time.perf_counter() < deadline:
+                # 首个请求慢或已失败：补发一个对冲请求
+                hedge_task = asyncio.create_task(attempt())
+                tasks.append(hedge_task)
+                pending.add(hedge_task)
+        raise last_error or httpx.TimeoutException(f"Emby request exceeded {EMBY_REQUEST_BUDGET_SECONDS}s budget")
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+
+def _mark_stale(endpoints):
+    ctx = _REQUEST_CONTEXT.get()
+    if ctx is not None:
+        ctx["stale"].update(endpoints)
+
+
+def _serve_stale(stale_key: str, endpoint: str, error):
+    entry = EMBY_STALE_CACHE.get(stale_key)
+    if entry is None:
+        if isinstance(error, Exception):
+            raise error
+        raise HTTPException(status_code=503, detail=f"Emby unavailable ({error})")
+    _mark_stale([endpoint])
+    _timing_count("emby-stale", "hit")
+    return entry["data"]
+
+
+async def _emby_get_json(client: httpx.AsyncClient, path: str, params: dict):
+    """
+    Emby 元数据 GET 的统一入口；失败或熔断时返回最近一次成功的结果（标记为 stale）
+    """
+    endpoint = _emby_endpoint_label(path)
+    breaker = _get_breaker(endpoint)
+    stale_key = path + "?" + urlencode(sorted((k, str(v)) for k, v in params.items() if k != "api_key"))
+    if not _breaker_allows(breaker):
+        return _serve_stale(stale_key, endpoint, "circuit open")
+
+    try:
+        with _timed("emby"):
+            data = await _hedged_get_json(
+                client, f"{EMBY_HOST}/emby{path}", params, breaker, hedge=EMBY_HEDGE_DELAY_MS > 0 and breaker["state"] == "closed"
+            )
+    except asyncio.CancelledError:
+        breaker["probe"] = False
+        raise
+    except Exception as e:
+        if _is_client_error(e):
+            # 4xx 说明 Emby 正常响应，只是请求本身不被接受
+            _breaker_record(breaker, True)
+            raise
+        _breaker_record(breaker, False)
+        return _serve_stale(stale_key, endpoint, e)
+
+    _breaker_record(breaker, True)
+    EMBY_STALE_CACHE[stale_key] = {"data": data, "at": time.time()}
+    EMBY_STALE_CACHE.move_to_end(stale_key)
+    while len(EMBY_STALE_CACHE) > EMBY_STALE_MAX_ENTRIES:
+        EMBY_STALE_CACHE.popitem(last=False)
+    return data
+
+
+@app.get("/api/admin/upstream")
+async def upstream_status(request: Request):
+    _require_admin(request)
+    now = time.monotonic()
+    return {
+        endpoint: {
+            "state": breaker["state"],
+            "failures": breaker["failures"],
+            "open_for_s": round(now - breaker["opened_at"], 1) if breaker["state"] == "open" else None,
+            "hedge_delay_ms": round(_hedge_delay(breaker) * 1000),
+        }
+        for endpoint, breaker in EMBY_BREAKERS.items()
+    }
+
+# --- 搜索索引 ---
+
+_SEARCH_RUN_RE = re.compile(
+    r"(?P<cjk>[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+)|(?P<word>[0-9a-z]+)"
+)
+_SEARCH_MAX_PREFIX = 24
+_SEARCH_FIELDS = "SortName,OriginalTitle,DateCreated,PremiereDate,ProductionYear"
+
+
+def _search_normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def _pinyin_aliases(text: str):
+    if lazy_pinyin is None:
+        return []
+    aliases = []
+    for match in _SEARCH_RUN_RE.finditer(_search_normalize(text)):
+        run = match.group("cjk")
+        if not run:
+            continue
+        try:
+            full = lazy_pinyin(run)
+            initials = lazy_pinyin(run, style=PinyinStyle.FIRST_LETTER)
+        except Exception:
+            continue
+        aliases.append("".join(full))
+        aliases.append("".join(initials))
+    return aliases
+
+
+def _search_index_tokens(text: str) -> set:
+    """
+    索引侧分词：CJK 用 1/2-gram（支持中文部分输入），字母数字用前缀（支持边输边搜）
+    """
+    tokens = set()
+    for match in _SEARCH_RUN_RE.finditer(_search_normalize(text)):
+        cjk = match.group("cjk")
+        if cjk:
+            tokens.update(cjk)
+            tokens.update(cjk[i:i + 2] for i in range(len(cjk) - 1))
+            continue
+        word = match.group("word")
+        tokens.update(word[:i] for i in range(1, min(len(word), _SEARCH_MAX_PREFIX) + 1))
+    return tokens
+
+
+def _search_query_tokens(text: str) -> list:
+    tokens = []
+    for match in _SEARCH_RUN_RE.finditer(_search_normalize(text)):
+        cjk = match.group("cjk")
+        if cjk:
+            if len(cjk) == 1:
+                tokens.append(cjk)
+            else:
+                tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+            continue
+        tokens.append(match.group("word")[:_SEARCH_MAX_PREFIX])
+    return list(dict.fromkeys(tokens))
+
+
+def _search_index_remove(item_id: str):
+    doc = SEARCH_DOCS.pop(item_id, None)
+    if not doc:
+        return
+    for token in doc["tokens"]:
+        posting = SEARCH_POSTINGS.get(token)
+        if posting is None:
+            continue
+        posting.discard(item_id)
+        if not posting:
+            SEARCH_POSTINGS.pop(token, None)
+
+
+def _search_index_upsert(raw_items):
+    """
+    增量写入索引：只处理 Series/Movie，标题未变化的条目仅更新排序时间
+    """
+    for raw in raw_items or []:
+        item_id = raw.get("Id")
+        item_type = raw.get("Type")
+        if not item_id or item_type not in ("Series", "Movie"):
+            continue
+
+        names = [raw.get("Name"), raw.get("SortName"), raw.get("OriginalTitle")]
+        names = [name for name in names if name]
+        names.extend(_pinyin_aliases(raw.get("Name") or ""))
+
+        existing = SEARCH_DOCS.get(item_id)
+        ts = _home_sort_timestamp(raw)
+        if existing and existing["names"] == names:
+            existing["ts"] = max(existing["ts"], ts)
+            continue
+
+        tokens = set()
+        for name in names:
+            tokens |= _search_index_tokens(name)
+
+        _search_index_remove(item_id)
+        SEARCH_DOCS[item_id] = {
+            "id": item_id,
+            "title": raw.get("Name") or "",
+            "type": item_type,
+            "year": raw.get("ProductionYear"),
+            "ts": max(ts, existing["ts"]) if existing else ts,
+            "names": names,
+            "prefix": _search_normalize(raw.get("Name") or ""),
+            "tokens": frozenset(tokens),
+        }
+        for token in tokens:
+            SEARCH_POSTINGS.setdefault(token, set()).add(item_id)
+
+
+def _search_query(query: str, limit: int):
+    tokens = _search_query_tokens(query)
+    if not tokens:
+        return []
+
+    hits = Counter()
+    for token in tokens:
+        for item_id in SEARCH_POSTINGS.get(token, ()):
+            hits[item_id] += 1
+
+    required = len(tokens)
+    matched = [item_id for item_id, count in hits.items() if count == required]
+    if not matched:
+        # 兜底：中文输入中间夹字（如 “进击巨人”）时按 n-gram 覆盖率放宽
+        matched = [item_id for item_id, count in hits.items() if count * 2 >= required]
+
+    normalized = _search_normalize(query).strip()
+    docs = [SEARCH_DOCS[item_id] for item_id in matched if item_id in SEARCH_DOCS]
+    docs.sort(
+        key=lambda doc: (
+            hits[doc["id"]],
+            1 if normalized and doc["prefix"].startswith(normalized) else 0,
+            doc["ts"],
+        ),
+        reverse=True,
+    )
+    return docs[:limit]
+
+
+async def _sync_search_index():
+    """
+    全量对齐 Emby 库（后台执行），并剔除已删除的条目
+    """
+    global SEARCH_LAST_SYNC
+    if not API_KEY:
+        return
+
+    params = {
+        "api_key": API_KEY,
+        "Recursive": "true",
+        "IncludeItemTypes": "Series,Movie",
+        "Fields": _SEARCH_FIELDS,
+        "SortBy": "SortName",
+        "SortOrder": "Ascending",
+    }
+    if USER_ID:
+        params["UserId"] = USER_ID
+
+    seen_ids = set()
+    start_index = 0
+    page_limit = 500
+    async with httpx.AsyncClient() as client:
+        while True:
+            page_params = dict(params)
+            page_params.update({"StartIndex": start_index, "Limit": page_limit})
+            data = await _emby_get_json(client, "/Items", page_params)
+            page = data.get("Items", []) or []
+            _search_index_upsert(page)
+            seen_ids.update(raw.get("Id") for raw in page if raw.get("Id"))
+            start_index += len(page)
+            total = data.get("TotalRecordCount")
+            if len(page) < page_limit or (isinstance(total, int) and start_index >= total):
+                break
+
+    for item_id in list(SEARCH_DOCS):
+        if item_id not in seen_ids:
+            _search_index_remove(item_id)
+    SEARCH_LAST_SYNC = time.time()
+
+
+async def _ensure_search_index():
+    """
+    索引过期时后台刷新；同步失败后至少间隔 SEARCH_RETRY_SECONDS 再重试（Emby 故障时不会每次搜索都回源）；
+    只有索引为空时才等待进行中的同步
+    """
+    global SEARCH_SYNC_TASK, SEARCH_LAST_ATTEMPT
+    now = time.time()
+    stale = now - SEARCH_LAST_SYNC > SEARCH_REFRESH_SECONDS
+    backoff = now - SEARCH_LAST_ATTEMPT < min(SEARCH_RETRY_SECONDS, SEARCH_REFRESH_SECONDS)
+    if stale and not backoff and (SEARCH_SYNC_TASK is None or SEARCH_SYNC_TASK.done()):
+        SEARCH_LAST_ATTEMPT = now
+
+        async def runner():
+            try:
+                await _sync_search_index()
+            except Exception as e:
+                print(f"Search index sync error: {e}")
+
+        SEARCH_SYNC_TASK = asyncio.create_task(runner())
+
+    if not SEARCH_DOCS and SEARCH_SYNC_TASK is not None and not SEARCH_SYNC_TASK.done():
+        await asyncio.shield(SEARCH_SYNC_TASK)
+
+# --- 列表数据 ---
+
+def _emby_items_params():
+    params = {"api_key": API_KEY, "Recursive": "true", "Fields": "Overview,PremiereDate,AirDays,SortName,OriginalTitle"}
+    if USER_ID:
+        params["UserId"] = USER_ID
+    return params
+
+
+def _unique_by_id(raw_items):
+    seen = set()
+    unique_items = []
+    for raw in raw_items:
+        raw_id = raw.get("Id")
+        if not raw_id or raw_id in seen:
+            continue
+        seen.add(raw_id)
+        unique_items.append(raw)
+    return unique_items
+
+
+def _raise_if_upstream_failure(exc: Exception):
+    """
+    4xx 只说明当前查询方式不被支持，可以换下一种兜底；
+    超时/5xx/熔断说明 Emby 本身不可用，立即失败，避免逐个兜底耗尽时间预算
+    """
+    if _is_client_error(exc):
+        return
+    if isinstance(exc, HTTPException):
+        raise exc
+    raise HTTPException(status_code=502, detail="Failed to fetch items from Emby") from exc
+
+
+async def _fetch_series_episodes(client: httpx.AsyncClient, series_id: str):
+    params = _emby_items_params()
+    items = []
+
+    # 1) 首选 Show Episodes (支持分页/去重，兼容 Emby 限制)
+    try:
+        show_base_params = {
+            "api_key": API_KEY,
+            "SortBy": "SortName",
+            "SortOrder": "Ascending",
+            "Fields": "Overview,PremiereDate,AirDays,SortName",
+        }
+        if USER_ID:
+            show_base_params["UserId"] = USER_ID
+
+        collected = []
+        seen_ids = set()
+        start_index = 0
+        page_limit = 200
+        while True:
+            page_params = dict(show_base_params)
+            page_params.update({"StartIndex": start_index, "Limit": page_limit})
+            data = await _emby_get_json(client, f"/Shows/{series_id}/Episodes", page_params)
+            page = data.get("Items", [])
+            if not page:
+                break
+            new_count = 0
+            for raw in page:
+                raw_id = raw.get("Id")
+                if not raw_id or raw_id in seen_ids:
+                    continue
+                seen_ids.add(raw_id)
+                collected.append(raw)
+                new_count += 1
+            if new_count == 0:
+                break
+            start_index += len(page)
+            total = data.get("TotalRecordCount")
+            if isinstance(total, int) and len(collected) >= total:
+                break
+            if start_index > 5000:
+                break
+        items = _unique_by_id(collected)
+    except Exception as e:
+        _raise_if_upstream_failure(e)
+        items = []
+
+    # 2) 兜底：按 Season 拉取 Episodes (有些库/元数据会导致 /Shows/{id}/Episodes 返回不全)
+    if len(items) <= 1:
+        try:
+            seasons = []
+            season_params = {"api_key": API_KEY}
+            if USER_ID:
+                season_params["UserId"] = USER_ID
+            try:
+                season_data = await _emby_get_json(client, f"/Shows/{series_id}/Seasons", season_params)
+                seasons = season_data.get("Items", []) or []
+            except Exception as e:
+                _raise_if_upstream_failure(e)
+                seasons = []
+
+            if not seasons:
+                season_query = dict(params)
+                season_query.update({
+                    "IncludeItemTypes": "Season",
+                    "ParentId": series_id,
+                    "Recursive": "true",
+                    "SortBy": "SortName",
+                    "SortOrder": "Ascending",
+                    "Limit": 2000,
+                })
+                season_data = await _emby_get_json(client, "/Items", season_query)
+                seasons = season_data.get("Items", []) or []
+
+            season_items = []
+            for season in seasons:
+                season_id = season.get("Id")
+                if not season_id:
+                    continue
+                season_query = dict(params)
+                season_query.update({
+                    "IncludeItemTypes": "Episode,Video",
+                    "ParentId": season_id,
+                    "Recursive": "false",
+                    "SortBy": "SortName",
+                    "SortOrder": "Ascending",
+                    "Limit": 2000,
+                })
+                s_ep_data = await _emby_get_json(client, "/Items", season_query)
+                season_items.extend(s_ep_data.get("Items", []))
+
+            items = _unique_by_id(season_items) or items
+        except Exception as e:
+            # 4xx 时保持 items，不中断主流程
+            _raise_if_upstream_failure(e)
+
+    # 3) 兜底：递归查询 Series 下的所有视频 (兼容 Episode/Video 混合)
+    if len(items) <= 1:
+        params.update({
+            "IncludeItemTypes": "Episode,Video",
+            "ParentId": series_id,
+            "SortBy": "SortName",
+            "SortOrder": "Ascending",
+            "Limit": 2000,
+        })
+        data = await _emby_get_json(client, "/Items", params)
+        items = _unique_by_id(data.get("Items", []))
+    with _timed("sort"):
+        items.sort(key=_episode_sort_key)
+    return items
+
+
+async def _get_series_episodes(series_id: str):
+    """
+    带短期缓存与并发去重的选集拉取；回源在独立任务中进行，不受单个请求断开影响。
+    回源用独立的请求上下文：兜底返回的过期数据不进缓存，并把 stale 标记带给每个等待者
+    """
+    entry = EPISODE_CACHE.get(series_id)
+    if entry and time.monotonic() - entry["at"] < EPISODE_CACHE_TTL:
+        _timing_count("cache-episodes", "hit")
+        EPISODE_CACHE.move_to_end(series_id)
+        return entry["items"]
+    _timing_count("cache-episodes", "miss")
+
+    task = EPISODE_INFLIGHT.get(series_id)
+    if task is None:
+
+        async def runner():
+            ctx = {"stale": set(), "timings": {}, "counters": {}}
+            _REQUEST_CONTEXT.set(ctx)
+            async with httpx.AsyncClient() as client:
+                items = await _fetch_series_episodes(client, series_id)
+            if not ctx["stale"]:
+                EPISODE_CACHE[series_id] = {"items": items, "at": time.monotonic()}
+                EPISODE_CACHE.move_to_end(series_id)
+                while len(EPISODE_CACHE) > EPISODE_CACHE_MAX_ENTRIES:
+                    EPISODE_CACHE.popitem(last=False)
+            return items, ctx
+
+        task = asyncio.create_task(runner())
+        EPISODE_INFLIGHT[series_id] = task
+        task.add_done_callback(lambda _: EPISODE_INFLIGHT.pop(series_id, None))
+    items, fetch_ctx = await asyncio.shield(task)
+    _mark_stale(fetch_ctx["stale"])
+    for name, (duration, count) in fetch_ctx["timings"].items():
+        _timing_add(name, duration, count)
+    return items
+
+
+async def _fetch_home_items(client: httpx.AsyncClient, limit: int):
+    home_params = _emby_items_params()
+    home_params.update(
+        {
+            "IncludeItemTypes": "Series,Movie",
+            "SortOrder": "Descending",
+            "Limit": limit,
+        }
+    )
+
+    data = None
+    for sort_by in ("DateLastMediaAdded", "DateLastContentAdded", "DateCreated"):
+        try:
+            candidate = dict(home_params)
+            candidate["SortBy"] = sort_by
+            data = await _emby_get_json(client, "/Items", candidate)
+            break
+        except Exception as e:
+            _raise_if_upstream_failure(e)
+            data = None
+
+    if data is None:
+        raise HTTPException(status_code=502, detail="Failed to fetch items from Emby")
+
+    items = data.get("Items", [])
+    with _timed("sort"):
+        items.sort(key=_home_sort_timestamp, reverse=True)
+    _search_index_upsert(items)
+    return items
+
+
+async def _build_video_items(items, series_mode: bool):
+    # TMDB：优先使用本地缓存；未命中则后台预取（不阻塞首页加载）
+    tmdb_results = []
+    if series_mode:
+        tmdb_results = [(None, None) for _ in items]
+    else:
+        for item in items:
+            name = item.get("Name") or ""
+            emby_type = item.get("Type") or ""
+            backdrop, logo = _get_tmdb_cached(name, emby_type)
+            tmdb_results.append((backdrop, logo))
+            if backdrop is None and logo is None:
+                await _prefetch_tmdb_images(name, emby_type)
+
+    videos = []
+    missing_placeholders = {}
+    for idx, item in enumerate(items):
+        # 安全获取各种图片 (通过代理)
+        # 我们的代理地址: /api/proxy/image?path=/Items/{id}/Images/Primary
+        poster_url = _proxy_image_url(item["Id"], "Primary", max_width=600, quality=90)
+
+        tmdb_backdrop, tmdb_logo = None, None
+        if not series_mode and isinstance(tmdb_results[idx], tuple):
+            tmdb_backdrop, tmdb_logo = tmdb_results[idx]
+
+        backdrop_url = tmdb_backdrop or _proxy_image_url(item["Id"], "Backdrop/0", max_width=1600, quality=80)
+        logo_url = tmdb_logo or _proxy_image_url(item["Id"], "Logo", max_width=700, quality=90)
+
+        season_number, episode_number = _extract_season_episode(item) if series_mode else (None, None)
+        # 选集列表不展示海报/背景，不需要占位图
+        if series_mode:
+            placeholders = {"poster": None, "backdrop": None}
+        else:
+            placeholders = _get_image_placeholders(item, missing_placeholders)
+
+        videos.append({
+            "id": item["Id"],
+            "title": item["Name"],
+            "type": item["Type"],
+            "poster_url": poster_url,
+            "backdrop_url": backdrop_url,
+            "logo_url": logo_url,
+            "poster_placeholder": placeholders["poster"],
+            "backdrop_placeholder": placeholders["backdrop"],
+            "year": item.get("ProductionYear"),
+            "air_days": item.get("AirDays", []),
+            "parent_index_number": season_number,
+            "index_number": episode_number,
+        })
+    _schedule_image_placeholders(missing_placeholders)
+    return videos
+
 # --- 核心路由 ---
 
 @app.get("/api/videos")
 async def get_video_list(request: Request, limit: int = 10, seriesId: str = None):
     async with httpx.AsyncClient() as client:
-        params = {"api_key": API_KEY, "Recursive": "true", "Fields": "Overview,PremiereDate,AirDays,SortName"}
-        if USER_ID: params["UserId"] = USER_ID
-
         try:
-            items = []
             if seriesId:
                 _require_play_auth(request)
-
-                def unique_by_id(raw_items):
-                    seen = set()
-                    unique_items = []
-                    for raw in raw_items:
-                        raw_id = raw.get("Id")
-                        if not raw_id or raw_id in seen:
-                            continue
-                        seen.add(raw_id)
-                        unique_items.append(raw)
-                    return unique_items
-
-                # 1) 首选 Show Episodes (支持分页/去重，兼容 Emby 限制)
-                try:
-                    show_base_params = {
-                        "api_key": API_KEY,
-                        "SortBy": "SortName",
-                        "SortOrder": "Ascending",
-                        "Fields": "Overview,PremiereDate,AirDays,SortName",
-                    }
-                    if USER_ID:
-                        show_base_params["UserId"] = USER_ID
-
-                    collected = []
-                    seen_ids = set()
-                    start_index = 0
-                    page_limit = 200
-                    while True:
-                        page_params = dict(show_base_params)
-                        page_params.update({"StartIndex": start_index, "Limit": page_limit})
-                        response = await client.get(f"{EMBY_HOST}/emby/Shows/{seriesId}/Episodes", params=page_params)
-                        response.raise_for_status()
-                        data = response.json()
-                        page = data.get("Items", [])
-                        if not page:
-                            break
-                        new_count = 0
-                        for raw in page:
-                            raw_id = raw.get("Id")
-                            if not raw_id or raw_id in seen_ids:
-                                continue
-                            seen_ids.add(raw_id)
-                            collected.append(raw)
-                            new_count += 1
-                        if new_count == 0:
-                            break
-                        start_index += len(page)
-                        total = data.get("TotalRecordCount")
-                        if isinstance(total, int) and len(collected) >= total:
-                            break
-                        if start_index > 5000:
-                            break
-                    items = unique_by_id(collected)
-                except Exception:
-                    items = []
-
-                # 2) 兜底：按 Season 拉取 Episodes (有些库/元数据会导致 /Shows/{id}/Episodes 返回不全)
-                if len(items) <= 1:
-                    try:
-                        seasons = []
-                        season_params = {"api_key": API_KEY}
-                        if USER_ID:
-                            season_params["UserId"] = USER_ID
-                        try:
-                            season_resp = await client.get(f"{EMBY_HOST}/emby/Shows/{seriesId}/Seasons", params=season_params)
-                            season_resp.raise_for_status()
-                            seasons = season_resp.json().get("Items", []) or []
-                        except Exception:
-                            seasons = []
-
-                        if not seasons:
-                            season_query = dict(params)
-                            season_query.update({
-                                "IncludeItemTypes": "Season",
-                                "ParentId": seriesId,
-                                "Recursive": "true",
-                                "SortBy": "SortName",
-                                "SortOrder": "Ascending",
-                                "Limit": 2000,
-                            })
-                            season_resp = await client.get(f"{EMBY_HOST}/emby/Items", params=season_query)
-                            season_resp.raise_for_status()
-                            seasons = season_resp.json().get("Items", []) or []
-
-                        season_items = []
-                        for season in seasons:
-                            season_id = season.get("Id")
-                            if not season_id:
-                                continue
-                            season_query = dict(params)
-                            season_query.update({
-                                "IncludeItemTypes": "Episode,Video",
-                                "ParentId": season_id,
-                                "Recursive": "false",
-                                "SortBy": "SortName",
-                                "SortOrder": "Ascending",
-                                "Limit": 2000,
-                            })
-                            s_ep_resp = await client.get(f"{EMBY_HOST}/emby/Items", params=season_query)
-                            s_ep_resp.raise_for_status()
-                            season_items.extend(s_ep_resp.json().get("Items", []))
-
-                        items = unique_by_id(season_items) or items
-                    except Exception:
-                        # 保持 items，不中断主流程
-                        pass
-
-                # 3) 兜底：递归查询 Series 下的所有视频 (兼容 Episode/Video 混合)
-                if len(items) <= 1:
-                    params.update({
-                        "IncludeItemTypes": "Episode,Video",
-                        "ParentId": seriesId,
-                        "SortBy": "SortName",
-                        "SortOrder": "Ascending",
-                        "Limit": 2000,
-                    })
-                    response = await client.get(f"{EMBY_HOST}/emby/Items", params=params)
-                    response.raise_for_status()
-                    data = response.json()
-                    items = unique_by_id(data.get("Items", []))
-                items.sort(key=_episode_sort_key)
+                items = await _get_series_episodes(seriesId)
             else:
-                home_params = dict(params)
-                home_params.update(
-                    {
-                        "IncludeItemTypes": "Series,Movie",
-                        "SortOrder": "Descending",
-                        "Limit": limit,
-                    }
-                )
-
-                response = None
-                data = None
-                for sort_by in ("DateLastMediaAdded", "DateLastContentAdded", "DateCreated"):
-                    try:
-                        candidate = dict(home_params)
-                        candidate["SortBy"] = sort_by
-                        response = await client.get(f"{EMBY_HOST}/emby/Items", params=candidate)
-                        response.raise_for_status()
-                        data = response.json()
-                        break
-                    except Exception:
-                        response = None
-                        data = None
-
-                if data is None:
-                    raise HTTPException(status_code=502, detail="Failed to fetch items from Emby")
-
-                items = data.get("Items", [])
-                items.sort(key=_home_sort_timestamp, reverse=True)
-            
-            # TMDB：优先使用本地缓存；未命中则后台预取（不阻塞首页加载）
-            tmdb_results = []
-            if seriesId:
-                tmdb_results = [(None, None) for _ in items]
-            else:
-                for item in items:
-                    name = item.get("Name") or ""
-                    emby_type = item.get("Type") or ""
-                    backdrop, logo = _get_tmdb_cached(name, emby_type)
-                    tmdb_results.append((backdrop, logo))
-                    if backdrop is None and logo is None:
-                        await _prefetch_tmdb_images(name, emby_type)
-
-            videos = []
-            for idx, item in enumerate(items):
-                # 安全获取各种图片 (通过代理)
-                # 我们的代理地址: /api/proxy/image?path=/Items/{id}/Images/Primary
-                poster_url = _proxy_image_url(item["Id"], "Primary", max_width=600, quality=90)
-                
-                tmdb_backdrop, tmdb_logo = None, None
-                if not seriesId and isinstance(tmdb_results[idx], tuple):
-                    tmdb_backdrop, tmdb_logo = tmdb_results[idx]
-
-                backdrop_url = tmdb_backdrop or _proxy_image_url(item["Id"], "Backdrop/0", max_width=1600, quality=80)
-                logo_url = tmdb_logo or _proxy_image_url(item["Id"], "Logo", max_width=700, quality=90)
-
-                season_number, episode_number = _extract_season_episode(item) if seriesId else (None, None)
-                
-                videos.append({
-                    "id": item["Id"],
-                    "title": item["Name"],
-                    "type": item["Type"],
-                    "poster_url": poster_url,
-                    "backdrop_url": backdrop_url,
-                    "logo_url": logo_url,
-                    "year": item.get("ProductionYear"),
-                    "air_days": item.get("AirDays", []),
-                    "parent_index_number": season_number,
-                    "index_number": episode_number,
-                })
+                items = await _fetch_home_items(client, limit)
+            with _timed("serialize"):
+                videos = await _build_video_items(items, series_mode=bool(seriesId))
             return {"items": videos}
         except HTTPException:
             raise
@@ -799,6 +2211,81 @@ async def get_video_list(request: Request, limit: int = 10, seriesId: str = None
             traceback.print_exc()
             raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/videos/batch")
+async def get_video_list_batch(request: Request, payload: dict = Body(...)):
+    """
+    批量获取多个剧集的选集列表（首页悬停预取 / 继续观看）
+    payload: {"seriesIds": [...], "limit": N, "after": {seriesId: episodeId}}
+    """
+    _require_play_auth(request)
+
+    series_ids = payload.get("seriesIds") if isinstance(payload, dict) else None
+    if not isinstance(series_ids, list) or not all(isinstance(sid, str) and sid for sid in series_ids):
+        raise HTTPException(status_code=400, detail="seriesIds must be a list of ids")
+    series_ids = list(dict.fromkeys(series_ids))
+    if len(series_ids) > BATCH_MAX_SERIES:
+        raise HTTPException(status_code=400, detail=f"Too many seriesIds (max {BATCH_MAX_SERIES})")
+
+    limit = _safe_int(payload.get("limit"))
+    after = payload.get("after") if isinstance(payload.get("after"), dict) else {}
+
+    async def load(series_id):
+        # 全局共享并发上限：多个批量请求同时到达时，回源 Emby 的总并发仍不超过 BATCH_CONCURRENCY
+        global BATCH_SEMAPHORE
+        if BATCH_SEMAPHORE is None:
+            BATCH_SEMAPHORE = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+        async with BATCH_SEMAPHORE:
+            return await _get_series_episodes(series_id)
+
+    results = await asyncio.gather(*(load(sid) for sid in series_ids), return_exceptions=True)
+
+    series = {}
+    errors = {}
+    for series_id, result in zip(series_ids, results):
+        if isinstance(result, Exception):
+            errors[series_id] = result.detail if isinstance(result, HTTPException) else str(result)
+            continue
+        start = 0
+        after_id = after.get(series_id)
+        if after_id:
+            # “继续观看”：从上次看到的那一集之后开始
+            ids = [raw.get("Id") for raw in result]
+            start = ids.index(after_id) + 1 if after_id in ids else 0
+        selected = result[start:start + limit] if limit and limit > 0 else result[start:]
+        with _timed("serialize"):
+            videos = await _build_video_items(selected, series_mode=True)
+        series[series_id] = {"total": len(result), "items": videos}
+    return {"series": series, "errors": errors}
+
+@app.get("/api/search")
+async def search_videos(q: str = "", limit: int = 20):
+    """
+    本地索引搜索（中文 n-gram / 前缀 / 拼音），按最近更新排序
+    """
+    query = (q or "").strip()
+    if not query:
+        return {"items": []}
+
+    await _ensure_search_index()
+    limit = max(1, min(limit, 100))
+
+    videos = []
+    with _timed("search"):
+        docs = _search_query(query, limit)
+    for doc in docs:
+        item_id = doc["id"]
+        backdrop, logo = _get_tmdb_cached(doc["title"], doc["type"])
+        videos.append({
+            "id": item_id,
+            "title": doc["title"],
+            "type": doc["type"],
+            "poster_url": _proxy_image_url(item_id, "Primary", max_width=600, quality=90),
+            "backdrop_url": backdrop or _proxy_image_url(item_id, "Backdrop/0", max_width=1600, quality=80),
+            "logo_url": logo or _proxy_image_url(item_id, "Logo", max_width=700, quality=90),
+            "year": doc["year"],
+        })
+    return {"items": videos}
+
 @app.get("/api/play/{item_id}")
 async def get_play_url(item_id: str, request: Request):
     """
@@ -812,9 +2299,7 @@ async def get_play_url(item_id: str, request: Request):
             if USER_ID:
                 emby_params["UserId"] = USER_ID
 
-            res = await client.get(f"{EMBY_HOST}/emby/Items/{item_id}", params=emby_params)
-            res.raise_for_status()
-            item = res.json()
+            item = await _emby_get_json(client, f"/Items/{item_id}", emby_params)
             
             series_id = item.get("SeriesId")
             season_id = item.get("SeasonId")
@@ -825,9 +2310,14 @@ async def get_play_url(item_id: str, request: Request):
             # 注意：如果服务器带宽撑不住，也可以考虑直接返回 Emby 地址，
             # 但那样就无法完全隐藏 API Key。
             masked_play_url = f"/api/proxy/stream/{item_id}"
+            hls_url = f"/api/proxy/hls/{item_id}/master.m3u8"
+            media_sources = item.get("MediaSources") or []
+            if media_sources and media_sources[0].get("Id"):
+                hls_url += "?" + urlencode({"mediaSourceId": media_sources[0]["Id"]})
             
             response_payload = {
                 "url": masked_play_url,
+                "hls_url": hls_url,
                 "type": item_type,
                 "series_id": series_id,
                 "season_id": season_id,
@@ -845,9 +2335,8 @@ async def get_play_url(item_id: str, request: Request):
             target_type = item.get("Type")
             if target_type == "Episode" and series_id:
                 try:
-                    s_res = await client.get(f"{EMBY_HOST}/emby/Items/{series_id}", params=emby_params)
-                    s_res.raise_for_status()
-                    target_name = s_res.json().get("Name") or target_name
+                    series_item = await _emby_get_json(client, f"/Items/{series_id}", emby_params)
+                    target_name = series_item.get("Name") or target_name
                     target_type = "Series"
                 except Exception:
                     pass
@@ -865,6 +2354,280 @@ async def get_play_url(item_id: str, request: Request):
             traceback.print_exc()
             return {"url": f"/api/proxy/stream/{item_id}", "type": "auto"}
 
+# --- 缓存预热 ---
+
+def _parse_proxy_image_url(url: str):
+    if not url or not url.startswith("/api/proxy/image?"):
+        return None
+    params = dict(parse_qsl(url.split("?", 1)[1]))
+    path = params.pop("path", None)
+    if not path:
+        return None
+    return path, params
+
+
+async def _warm_image(client: httpx.AsyncClient, url: str) -> str:
+    """
+    与 /api/proxy/image 使用同一缓存键，只拉取尚未落盘的变体
+    """
+    parsed = _parse_proxy_image_url(url)
+    if not parsed or not ENABLE_DISK_CACHE:
+        return "skipped"
+    clean_path, params = parsed
+    if not _is_allowed_emby_image_path(clean_path):
+        return "skipped"
+
+    _, cache_meta_path, cache_bytes_path = _image_cache_paths(clean_path, params)
+    if os.path.exists(cache_meta_path) and os.path.exists(cache_bytes_path):
+        return "cached"
+
+    forward_params = dict(params)
+    forward_params["api_key"] = API_KEY
+    try:
+        resp = await client.get(f"{EMBY_HOST}/emby{clean_path}", params=forward_params, timeout=10.0)
+        if resp.status_code != 200:
+            return "failed"
+        _write_image_cache(cache_meta_path, cache_bytes_path, resp)
+        return "fetched"
+    except Exception:
+        return "failed"
+
+
+async def _run_cache_warm(reason: str = "manual"):
+    started = time.time()
+    WARM_STATE.clear()
+    WARM_STATE.update({
+        "running": True,
+        "reason": reason,
+        "started_at": int(started),
+        "images_total": 0,
+        "images_done": 0,
+        "fetched": 0,
+        "cached": 0,
+        "failed": 0,
+        "skipped": 0,
+        "tmdb_lookups": 0,
+        "series": 0,
+        "timings_ms": {},
+    })
+    timings = WARM_STATE["timings_ms"]
+    semaphore = asyncio.Semaphore(max(1, WARM_CONCURRENCY))
+    print(f"🔥 缓存预热开始 ({reason})")
+
+    try:
+        async with httpx.AsyncClient() as client:
+            phase = time.perf_counter()
+            home_items = await _fetch_home_items(client, WARM_HOME_LIMIT)
+            timings["home"] = round((time.perf_counter() - phase) * 1000)
+
+            # 先补齐 TMDB，这样后面生成的 URL 与接口实际下发的一致
+            phase = time.perf_counter()
+
+            async def tmdb_lookup(item):
+                name = item.get("Name") or ""
+                emby_type = item.get("Type") or ""
+                if f"{name}_{emby_type}" in TMDB_CACHE:
+                    return
+                async with semaphore:
+                    await fetch_tmdb_images(client, name, emby_type)
+                    WARM_STATE["tmdb_lookups"] += 1
+
+            if TMDB_READ_TOKEN:
+                await asyncio.gather(*(tmdb_lookup(item) for item in home_items))
+            timings["tmdb"] = round((time.perf_counter() - phase) * 1000)
+
+            urls = []
+            for video in await _build_video_items(home_items, series_mode=False):
+                urls.extend([video["poster_url"], video["backdrop_url"], video["logo_url"]])
+
+            phase = time.perf_counter()
+            top_series = [item for item in home_items if item.get("Type") == "Series"][:WARM_TOP_SERIES]
+            for series in top_series:
+                try:
+                    episodes = await _get_series_episodes(series["Id"])
+                except Exception as e:
+                    print(f"Warm series error ({series.get('Id')}): {e}")
+                    continue
+                WARM_STATE["series"] += 1
+                for video in await _build_video_items(episodes, series_mode=True):
+                    urls.append(video["poster_url"])
+            timings["series"] = round((time.perf_counter() - phase) * 1000)
+
+            urls = [url for url in dict.fromkeys(urls) if _parse_proxy_image_url(url)]
+            WARM_STATE["images_total"] = len(urls)
+
+            phase = time.perf_counter()
+
+            async def warm_one(url):
+                async with semaphore:
+                    outcome = await _warm_image(client, url)
+                WARM_STATE[outcome] += 1
+                WARM_STATE["images_done"] += 1
+                done = WARM_STATE["images_done"]
+                if done % 50 == 0 or done == len(urls):
+                    print(f"🔥 预热进度 {done}/{len(urls)}")
+
+            await asyncio.gather(*(warm_one(url) for url in urls))
+            timings["images"] = round((time.perf_counter() - phase) * 1000)
+
+            # 占位图由列表构建时调度，这里等它们落盘
+            if PLACEHOLDER_TASKS:
+                await asyncio.gather(*list(PLACEHOLDER_TASKS), return_exceptions=True)
+    except Exception as e:
+        WARM_STATE["error"] = str(e)
+        print(f"Cache warm error: {e}")
+    finally:
+        timings["total"] = round((time.time() - started) * 1000)
+        WARM_STATE["running"] = False
+        WARM_STATE["finished_at"] = int(time.time())
+        print(
+            f"🔥 缓存预热完成: 图片 {WARM_STATE['images_total']} 个 "
+            f"(新拉取 {WARM_STATE['fetched']}, 已缓存 {WARM_STATE['cached']}, 失败 {WARM_STATE['failed']}), "
+            f"耗时 {timings['total']} ms"
+        )
+    return dict(WARM_STATE)
+
+
+def _start_cache_warm(reason: str):
+    global WARM_TASK
+    if WARM_TASK is not None and not WARM_TASK.done():
+        return WARM_TASK
+    WARM_TASK = asyncio.create_task(_run_cache_warm(reason))
+    return WARM_TASK
+
+
+async def _cache_warm_scheduler():
+    while True:
+        await asyncio.sleep(WARM_INTERVAL_SECONDS)
+        try:
+            await _start_cache_warm("scheduled")
+        except Exception as e:
+            print(f"Scheduled warm error: {e}")
+
+
+@app.get("/api/admin/warm")
+async def cache_warm_status(request: Request):
+    _require_admin(request)
+    return WARM_STATE
+
+
+@app.post("/api/admin/warm")
+async def cache_warm_trigger(request: Request, wait: bool = False):
+    """
+    手动触发预热（Emby 扫库后由 cron 调用）；已在运行时复用当前任务
+    """
+    _require_admin(request)
+    task = _start_cache_warm("manual")
+    if wait:
+        return await asyncio.shield(task)
+    return {"started": True, **WARM_STATE}
+
+
+async def _run_cli_cache_warm():
+    await asyncio.gather(_load_tmdb_cache_from_disk(), _load_placeholders_from_disk())
+    return await _run_cache_warm("cli")
+
+
+def _warm_cli(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="main.py warm", description="预热首页与热门剧集的图片/TMDB 缓存")
+    parser.add_argument("--url", help="触发已运行的后端（如 http://127.0.0.1:8800），否则在本进程内预热")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        if not ADMIN_TOKEN:
+            raise SystemExit("ADMIN_TOKEN 未设置")
+        resp = httpx.post(
+            f"{args.url.rstrip('/')}/api/admin/warm",
+            params={"wait": "true"},
+            headers={"X-Admin-Token": ADMIN_TOKEN},
+            timeout=None,
+        )
+        print(json.dumps(resp.json(), ensure_ascii=False, indent=2))
+        raise SystemExit(0 if resp.status_code == 200 else 1)
+
+    # 独立进程预热时降低调度优先级，避免和在线服务抢 CPU
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+    result = asyncio.run(_run_cli_cache_warm())
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    raise SystemExit(1 if result.get("error") else 0)
+
+
+# --- 启动与健康检查 ---
+
+def _spawn_background(coro):
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    return task
+
+
+async def _prewarm_home():
+    # 与前端首页相同的 limit，顺带填充过期兜底缓存、搜索索引、TMDB/占位图预取
+    async with httpx.AsyncClient() as client:
+        items = await _fetch_home_items(client, WARM_HOME_LIMIT)
+        await _build_video_items(items, series_mode=False)
+
+
+async def _startup_warmup():
+    started = time.perf_counter()
+    phases = READY_STATE["phases"]
+
+    phase = time.perf_counter()
+    await asyncio.gather(_load_tmdb_cache_from_disk(), _load_placeholders_from_disk(), _load_hls_segment_index())
+    phases["caches_ms"] = round((time.perf_counter() - phase) * 1000)
+    phases["tmdb_entries"] = len(TMDB_CACHE)
+
+    if STARTUP_PREWARM and API_KEY:
+        _spawn_background(_ensure_search_index())
+        phase = time.perf_counter()
+        try:
+            await asyncio.wait_for(_prewarm_home(), timeout=STARTUP_READY_TIMEOUT)
+            phases["home"] = "ok"
+        except Exception as e:
+            # Emby 不可用时也要就绪，否则滚动重启会一直卡住
+            phases["home"] = f"skipped ({type(e).__name__})"
+        phases["home_ms"] = round((time.perf_counter() - phase) * 1000)
+
+    READY_STATE["ready"] = True
+    print(f"✅ 启动预热完成，耗时 {round((time.perf_counter() - started) * 1000)} ms")
+
+
+def _startup():
+    _get_auth_secret_bytes()
+    _spawn_background(_startup_warmup())
+    if WARM_INTERVAL_SECONDS > 0:
+        _spawn_background(_cache_warm_scheduler())
+
+
+async def _shutdown():
+    tasks = list(BACKGROUND_TASKS)
+    for task in (WARM_TASK, SEARCH_SYNC_TASK, STREAM_REAPER_TASK):
+        if task is not None:
+            tasks.append(task)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    payload = {"ready": READY_STATE["ready"], **READY_STATE["phases"]}
+    return JSONResponse(payload, status_code=200 if READY_STATE["ready"] else 503)
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "warm":
+        _warm_cli(sys.argv[2:])
+
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8800)
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+import pytest
+
+os.environ.setdefault("EMBY_HOST", "http://emby.test")
+os.environ.setdefault("EMBY_API_KEY", "secret-key")
+os.environ.setdefault("AUTH_SECRET", "test-secret")
+os.environ.setdefault("ENABLE_DISK_CACHE", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+RealAsyncClient = httpx.AsyncClient
+
+MASTER = "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1500000\nmain.m3u8?PlaySessionId=abc&api_key=secret-key\n"
+VARIANT = (
+    "#EXTM3U\n"
+    '#EXT-X-MAP:URI="hls1/main/init.mp4?api_key=secret-key"\n'
+    "#EXTINF:3,\n"
+    "hls1/main/0.ts?x=1&api_key=secret-key\n"
+    "#EXT-X-ENDLIST\n"
+)
+
+
+class FakeEmby:
+    """
+    假 Emby：返回固定的 master/子播放列表与分片，并记录每次上游请求
+    """
+
+    def __init__(self, segment_delay: float = 0):
+        self.calls = []
+        self.segment_delay = segment_delay
+        self.playback_info_status = 200
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        self.calls.append(path)
+        if path.endswith("/PlaybackInfo"):
+            if self.playback_info_status != 200:
+                return httpx.Response(self.playback_info_status)
+            return httpx.Response(200, json={"MediaSources": [{"Id": "ms1"}]})
+        if path.endswith("/master.m3u8"):
+            return httpx.Response(200, text=MASTER)
+        if path.endswith("/main.m3u8"):
+            return httpx.Response(200, text=VARIANT)
+        if "/hls1/" in path:
+            await asyncio.sleep(self.segment_delay)
+            return httpx.Response(200, content=b"SEGMENT")
+        return httpx.Response(404)
+
+    def segment_calls(self) -> int:
+        return sum(1 for path in self.calls if path.endswith(".ts"))
+
+
+@pytest.fixture
+def emby(monkeypatch, tmp_path):
+    fake = FakeEmby()
+
+    def client_factory(*args, **kwargs):
+        kwargs["transport"] = httpx.MockTransport(fake.handler)
+        return RealAsyncClient(*args, **kwargs)
+
+    monkeypatch.setattr(main.httpx, "AsyncClient", client_factory)
+    monkeypatch.setattr(main, "HLS_SEGMENT_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "HLS_SEGMENT_INDEX", main.OrderedDict())
+    monkeypatch.setattr(main, "HLS_SEGMENT_INFLIGHT", {})
+    monkeypatch.setattr(main, "HLS_SEGMENT_BYTES", 0)
+    monkeypatch.setattr(main, "HLS_MEDIA_SOURCES", {})
+    monkeypatch.setattr(main, "EMBY_BREAKERS", {})
+    monkeypatch.setattr(main, "EMBY_STALE_CACHE", main.OrderedDict())
+    return fake
+
+
+@pytest.fixture
+def client():
+    test_client = TestClient(main.app)
+    test_client.cookies.set(main.AUTH_COOKIE_NAME, main._make_auth_token(int(time.time()) + 3600))
+    return test_client
+
+
+def _proxy_lines(text: str) -> list:
+    return [line for line in text.splitlines() if line.startswith("/api/proxy/hls/")]
+
+
+def _variant(client, item_id: str = "item1") -> str:
+    master = client.get(f"/api/proxy/hls/{item_id}/master.m3u8")
+    assert master.status_code == 200
+    return client.get(_proxy_lines(master.text)[0]).text
+
+
+def test_playlists_are_rewritten_without_api_key(emby, client):
+    master = client.get("/api/proxy/hls/item1/master.m3u8")
+    assert master.status_code == 200
+    assert _proxy_lines(master.text)[0].startswith("/api/proxy/hls/item1/main.m3u8?t=")
+
+    variant = _variant(client)
+    assert '#EXT-X-MAP:URI="/api/proxy/hls/item1/init.mp4?t=' in variant
+    assert _proxy_lines(variant)[0].startswith("/api/proxy/hls/item1/0.ts?t=")
+    assert "api_key" not in master.text + variant
+    assert "secret-key" not in master.text + variant
+
+
+def test_token_is_rejected_for_another_item(emby, client):
+    segment = _proxy_lines(_variant(client))[0]
+    assert client.get(segment).status_code == 200
+    assert client.get(segment.replace("/item1/", "/item2/", 1)).status_code == 403
+    assert client.get(segment.replace("s=", "s=x", 1)).status_code == 403
+
+
+def test_inflight_segment_is_fetched_once(emby, client):
+    segment = _proxy_lines(_variant(client))[0]
+    emby.segment_delay = 0.05
+
+    async def fetch_concurrently():
+        transport = httpx.ASGITransport(app=main.app)
+        async with RealAsyncClient(transport=transport, base_url="http://testserver", cookies=client.cookies) as async_client:
+            return await asyncio.gather(*(async_client.get(segment) for _ in range(3)))
+
+    responses = asyncio.run(fetch_concurrently())
+    assert [r.content for r in responses] == [b"SEGMENT"] * 3
+    assert emby.segment_calls() == 1
+
+
+def test_cached_segment_is_fetched_once(emby, client, monkeypatch):
+    monkeypatch.setattr(main, "ENABLE_DISK_CACHE", True)
+    segment = _proxy_lines(_variant(client))[0]
+    for _ in range(3):
+        assert client.get(segment).content == b"SEGMENT"
+    assert emby.segment_calls() == 1
+
+
+@pytest.mark.parametrize("upstream_status, expected", [(404, 404), (500, 502)])
+def test_media_source_lookup_errors_are_mapped(emby, client, upstream_status, expected):
+    emby.playback_info_status = upstream_status
+    response = client.get("/api/proxy/hls/item1/master.m3u8")
+    assert response.status_code == expected
+    assert not any(path.endswith("/master.m3u8") for path in emby.calls)